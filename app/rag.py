@@ -7,6 +7,7 @@ import sqlite3
 import sys
 import tempfile
 import textwrap
+import time
 from pathlib import Path
 from typing import List
 
@@ -28,11 +29,15 @@ API_URL = f"{BASE_URL}/chat/completions"
 HEADERS = {"Authorization": f"Bearer {AIPIPE_KEY}", "Content-Type": "application/json"}
 
 # ─── Retrieval assets ──────────────────────────────────────────────────
-DB_PATH     = Path("knowledge_base.db")
-INDEX_BIN   = Path("faiss.index")
-ID_MAP_JSON = Path("faiss_ids.json")
-EMBED_MODEL = "BAAI/bge-small-en-v1.5"
-TOP_K       = 6
+DB_PATH         = Path("knowledge_base.db")
+INDEX_BIN       = Path("faiss.index")
+ID_MAP_JSON     = Path("faiss_ids.json")
+EMBED_MODEL     = "BAAI/bge-small-en-v1.5"
+TOP_K           = int(os.getenv("RAG_TOP_K", "6"))           # passages kept after rerank
+CANDIDATES      = int(os.getenv("RAG_CANDIDATES", "30"))     # over-fetched from FAISS
+MMR_LAMBDA      = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))  # 1.0 = pure relevance
+PROMPT_TOKENS   = max(1, int(os.getenv("RAG_PROMPT_TOKENS", "1200")))  # whole user prompt
+CHARS_PER_TOKEN = 4                                          # rough estimate, no tokenizer
 
 # ─── Init ──────────────────────────────────────────────────────────────
 def init_rag() -> dict:
@@ -48,10 +53,35 @@ def init_rag() -> dict:
 
 
 # ─── Retrieval helper ──────────────────────────────────────────────────
+def _mmr(q_vec: np.ndarray, vecs: np.ndarray, k: int) -> List[int]:
+    """Maximal marginal relevance over normalised vectors; returns row order."""
+    rel    = vecs @ q_vec
+    sim    = vecs @ vecs.T
+    picked: List[int] = []
+    left   = list(range(len(vecs)))
+    while left and len(picked) < k:
+        if picked:
+            redundancy = sim[np.ix_(left, picked)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(left), dtype="float32")
+        scores = MMR_LAMBDA * rel[left] - (1 - MMR_LAMBDA) * redundancy
+        best   = left[int(np.argmax(scores))]
+        picked.append(best)
+        left.remove(best)
+    return picked
+
+
 def _retrieve(state: dict, query: str) -> List[sqlite3.Row]:
-    q_vec = np.array(list(state["embed"].embed([query]))[0], dtype="float32")[None, :]
-    _, I  = state["index"].search(q_vec, TOP_K)
-    ids   = [state["id_map"][str(i)] for i in I[0]]
+    q_vec = np.array(list(state["embed"].embed([query]))[0], dtype="float32")
+    _, I  = state["index"].search(q_vec[None, :], max(CANDIDATES, TOP_K))
+    pos   = [int(i) for i in I[0] if i != -1]
+    if not pos:
+        return []
+
+    # Rerank the candidates locally with the vectors already in the index.
+    vecs  = np.vstack([state["index"].reconstruct(i) for i in pos])
+    pos   = [pos[j] for j in _mmr(q_vec, vecs, TOP_K)]
+    ids   = [state["id_map"][str(i)] for i in pos]
 
     cur = state["db"].execute(
         f"""
@@ -63,7 +93,59 @@ def _retrieve(state: dict, query: str) -> List[sqlite3.Row]:
         """,
         ids * 2,
     )
-    return cur.fetchall()
+    rank = {cid: r for r, cid in enumerate(ids)}
+    return sorted(cur.fetchall(), key=lambda row: rank.get(row["id"], len(rank)))
+
+
+# ─── Prompt packing ────────────────────────────────────────────────────
+def _estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _passage_line(n: int, text: str) -> str:
+    return f"(Passage {n}) {text}"
+
+
+def _pack_passages(passages: List[sqlite3.Row], budget: int) -> List[tuple[int, str]]:
+    """Clean passages and keep as many as fit in ``budget`` tokens, in rank order.
+
+    Returns ``(n, text)`` pairs where ``n`` is the passage's 1-based rank, so
+    ``(Passage n)`` in the prompt always matches the n-th link.  Each passage
+    is charged with that prefix and the blank line joining it to the next.
+    """
+    packed: List[tuple[int, str]] = []
+    used = 0
+    for n, p in enumerate(passages, 1):
+        text = p["text"].replace("\n", " ").strip()
+        if "![" in text:
+            text = text.split("![", 1)[0]
+        if not text:
+            continue
+        overhead = len(_passage_line(n, "")) + len("\n\n")
+        cost = _estimate_tokens(text) + overhead // CHARS_PER_TOKEN + 1
+        if used + cost > budget:
+            if packed:
+                continue  # a shorter, lower-ranked passage may still fit
+            # keep at least the best passage, trimmed to the budget
+            room = max(budget - 2, 0) * CHARS_PER_TOKEN - overhead - 1
+            if room <= 0:
+                break
+            text = text[:room].rstrip() + "…"
+            cost = _estimate_tokens(text) + overhead // CHARS_PER_TOKEN + 1
+        packed.append((n, text))
+        used += cost
+    return packed
+
+
+def _build_prompt(question: str, context: str) -> str:
+    return (
+        "You are a helpful TA for IIT‑M’s Tools in Data Science course.\n"
+        "Use the following forum passages to answer the student’s question. "
+        "Be concise (3–4 sentences) and cite passage numbers like (Passage 2) if needed.\n\n"
+        f"{context}\n\n"
+        f"Question: {question}\n\n"
+        "Answer:"
+    )
 
 
 # ─── Image helper ──────────────────────────────────────────────────────
@@ -117,8 +199,15 @@ def _ask_ai_pipe(prompt: str) -> str:
 
 
 # ─── Public API function ───────────────────────────────────────────────
+def _log_stats(**fields) -> None:
+    if DEBUG:
+        sys.stderr.write("rag_stats " + " ".join(f"{k}={v}" for k, v in fields.items()) + "\n")
+
+
 def answer_question(state: dict, question: str, image: str | None = None) -> dict:
+    t0 = time.perf_counter()
     passages = _retrieve(state, question)
+    t_retrieve = time.perf_counter() - t0
 
     links = [
         {"url": p["source_url"], "text": textwrap.shorten(p["text"].replace("\n", " "), width=120, placeholder="…")}
@@ -126,24 +215,21 @@ def answer_question(state: dict, question: str, image: str | None = None) -> dic
     ]
 
     if not passages:
+        _log_stats(passages="0/0", prompt_tokens=0, over_budget=0,
+                   retrieval_s=f"{t_retrieve:.3f}", total_s=f"{time.perf_counter() - t0:.3f}")
         return {"answer": "I couldn't find any relevant documents.", "links": links}
 
-    cleaned_passages = []
-    for i, p in enumerate(passages, 1):
-        text = p["text"].replace("\n", " ").strip()
-        if "![" in text:
-            text = text.split("![", 1)[0]
-        cleaned_passages.append(f"(Passage {i}) {text}")
-    context = "\n\n".join(cleaned_passages)
+    # Only passages that fit the prompt budget are shown to the model.
+    budget = PROMPT_TOKENS - _estimate_tokens(_build_prompt(question, ""))
+    packed = _pack_passages(passages, budget)
+    over_budget = not packed
+    if over_budget:
+        # The question alone fills the budget: still give the model the best
+        # passage, trimmed to the full budget, rather than no context at all.
+        packed = _pack_passages(passages, PROMPT_TOKENS)[:1]
 
-    prompt = (
-        "You are a helpful TA for IIT‑M’s Tools in Data Science course.\n"
-        "Use the following forum passages to answer the student’s question. "
-        "Be concise (3–4 sentences) and cite passage numbers like (Passage 2) if needed.\n\n"
-        f"{context}\n\n"
-        f"Question: {question}\n\n"
-        "Answer:"
-    )
+    context = "\n\n".join(_passage_line(n, text) for n, text in packed)
+    prompt  = _build_prompt(question, context)
 
     try:
         answer = _ask_ai_pipe(prompt)
@@ -157,4 +243,8 @@ def answer_question(state: dict, question: str, image: str | None = None) -> dic
     if image:
         answer += "\n\n" + _handle_image(image)
 
-    return {"answer": answer, "links": links}
\ No newline at end of file
+    _log_stats(passages=f"{len(packed)}/{len(passages)}", prompt_tokens=_estimate_tokens(prompt),
+               over_budget=int(over_budget), retrieval_s=f"{t_retrieve:.3f}",
+               total_s=f"{time.perf_counter() - t0:.3f}")
+
+    return {"answer": answer, "links": links}
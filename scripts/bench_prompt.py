@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+scripts/bench_prompt.py
+───────────────────────────────────────────────────────────────────────────────
+Compare prompt size, end‑to‑end latency and link recall of the RAG pipeline on
+a question set, for two retrieval configurations:
+
+    old   – plain top‑K from FAISS, no rerank, no prompt budget
+            (RAG_CANDIDATES = RAG_TOP_K, RAG_MMR_LAMBDA = 1, unlimited budget)
+    new   – current defaults (over‑fetch + MMR rerank + RAG_PROMPT_TOKENS)
+
+Both configs answer every question back to back, and the order alternates
+from one question to the next, so neither side gets the warmer caches or the
+later AIPipe conditions.
+
+Questions are read from a promptfoo YAML file (`question:` plus the optional
+`link:` var of each test), or from a text file with one question per line,
+optionally followed by a tab and the expected link.  A link "hit" means the
+expected link appears in one of the returned link URLs, like promptfoo's
+`contains` check.
+
+Prompt tokens use the same ~4 chars/token estimate as app/rag.py.  Latency is
+measured around answer_question(), so it includes the AIPipe call unless
+--no-llm is given.
+
+Usage
+─────
+    python scripts/bench_prompt.py [QUESTIONS] [--no-llm]
+
+    QUESTIONS defaults to project-tds-virtual-ta-promptfoo.yaml.
+    Run from the repo root (needs knowledge_base.db, faiss.index, faiss_ids.json).
+"""
+
+from __future__ import annotations
+import argparse, pathlib, re, statistics, sys, time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from app import rag  # noqa: E402
+
+DEFAULT_QUESTIONS = "project-tds-virtual-ta-promptfoo.yaml"
+UNLIMITED         = 10**9
+PASSAGE_RE        = re.compile(r"^\(Passage \d+\) ", flags=re.M)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+def load_questions(path: pathlib.Path) -> list[tuple[str, str | None]]:
+    """Return ``(question, expected_link)`` pairs; the link may be None."""
+    text  = path.read_text(encoding="utf-8")
+    cases: list[tuple[str, str | None]] = []
+    if path.suffix in {".yaml", ".yml"}:
+        for line in text.splitlines():
+            m = re.match(r"^\s*(question|link):\s*(.+?)\s*$", line)
+            if not m:
+                continue
+            value = m.group(2).strip("\"'")
+            if m.group(1) == "question":
+                cases.append((value, None))
+            elif cases and cases[-1][1] is None:
+                cases[-1] = (cases[-1][0], value)
+        return cases
+    for line in text.splitlines():
+        if line.strip():
+            q, _, link = line.partition("\t")
+            cases.append((q.strip(), link.strip() or None))
+    return cases
+
+
+def configure(*, candidates: int, mmr_lambda: float, prompt_tokens: int) -> None:
+    rag.CANDIDATES    = candidates
+    rag.MMR_LAMBDA    = mmr_lambda
+    rag.PROMPT_TOKENS = prompt_tokens
+
+
+def ask(state: dict, question: str, expected: str | None, *, use_llm: bool) -> dict:
+    """Answer one question under the current config and collect its metrics."""
+    prompts: list[str] = []
+    call_llm = rag._ask_ai_pipe
+
+    def record(prompt: str) -> str:
+        prompts.append(prompt)
+        return call_llm(prompt) if use_llm else "(skipped)"
+
+    rag._ask_ai_pipe = record
+    try:
+        t0  = time.perf_counter()
+        out = rag.answer_question(state, question)
+        latency = time.perf_counter() - t0
+    finally:
+        rag._ask_ai_pipe = call_llm
+
+    prompt = prompts[0] if prompts else ""  # nothing retrieved → no prompt sent
+    urls   = [link["url"] for link in out["links"]]
+    return {
+        "tokens":  rag._estimate_tokens(prompt) if prompt else 0,
+        "latency": latency,
+        "packed":  len(PASSAGE_RE.findall(prompt)),
+        "links":   len(urls),
+        "hit":     None if expected is None else any(expected in u for u in urls),
+    }
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("questions", nargs="?", default=DEFAULT_QUESTIONS)
+    ap.add_argument("--no-llm", action="store_true", help="skip the AIPipe call (retrieval + packing only)")
+    args = ap.parse_args()
+
+    cases = load_questions(pathlib.Path(args.questions))
+    if not cases:
+        sys.exit(f"No questions found in {args.questions}")
+
+    state   = rag.init_rag()
+    configs = {
+        "old": {"candidates": rag.TOP_K, "mmr_lambda": 1.0, "prompt_tokens": UNLIMITED},
+        "new": {"candidates": rag.CANDIDATES, "mmr_lambda": rag.MMR_LAMBDA, "prompt_tokens": rag.PROMPT_TOKENS},
+    }
+
+    configure(**configs["new"])
+    ask(state, cases[0][0], None, use_llm=False)  # warm up the embedder
+
+    results: dict[str, list[dict]] = {name: [] for name in configs}
+    print(f"{'#':>3} {'old tok':>8} {'pass/links':>10} {'hit':>4}   {'new tok':>8} {'pass/links':>10} {'hit':>4}")
+    for i, (question, expected) in enumerate(cases):
+        order = ("old", "new") if i % 2 == 0 else ("new", "old")
+        row   = {}
+        for name in order:
+            configure(**configs[name])
+            row[name] = ask(state, question, expected, use_llm=not args.no_llm)
+            results[name].append(row[name])
+        cells = [
+            f"{row[n]['tokens']:>8} {str(row[n]['packed']) + '/' + str(row[n]['links']):>10} "
+            f"{'-' if row[n]['hit'] is None else 'y' if row[n]['hit'] else 'n':>4}"
+            for n in ("old", "new")
+        ]
+        print(f"{i + 1:>3} {cells[0]}   {cells[1]}")
+    configure(**configs["new"])
+
+    print(f"\n{len(cases)} questions, LLM {'skipped' if args.no_llm else 'called'}, order alternated\n")
+    print(f"{'config':<6} {'median tokens':>14} {'median latency (s)':>19} {'median packed':>14} {'link hits':>10}")
+    medians = {}
+    for name, rows in results.items():
+        tokens  = statistics.median(r["tokens"] for r in rows)
+        latency = statistics.median(r["latency"] for r in rows)
+        packed  = statistics.median(r["packed"] for r in rows)
+        scored  = [r["hit"] for r in rows if r["hit"] is not None]
+        hits    = f"{sum(scored)}/{len(scored)}" if scored else "n/a"
+        medians[name] = (tokens, latency)
+        print(f"{name:<6} {tokens:>14.0f} {latency:>19.3f} {packed:>14.0f} {hits:>10}")
+
+    (old_tok, old_lat), (new_tok, new_lat) = medians["old"], medians["new"]
+    if old_tok:
+        print(f"\nprompt tokens: {100 * (old_tok - new_tok) / old_tok:+.1f}% reduction")
+    if old_lat:
+        print(f"latency:       {100 * (new_lat - old_lat) / old_lat:+.1f}% change")
+
+
+if __name__ == "__main__":
+    main()